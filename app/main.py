@@ -1,5 +1,10 @@
 # standard library
+import math
+import threading
+from bisect import bisect_right
+from contextlib import asynccontextmanager
 from enum import Enum
+from functools import cached_property, lru_cache
 from io import BytesIO
 from typing import Self
 
@@ -8,43 +13,125 @@ import matplotlib.pyplot as plt
 import mplcyberpunk
 import numpy as np
 from fastapi import (
-    BackgroundTasks,
     Depends,
     FastAPI,
     HTTPException,
     Response,
     status
 )
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from matplotlib.ticker import FormatStrFormatter
 from pydantic import (
     BaseModel,
     computed_field,
+    ConfigDict,
     Field,
     model_validator,
     PositiveInt
 )
-from scipy.stats import norm as norm_rv
+from scipy.special import ndtri
 from starlette.responses import RedirectResponse
 
 
 # mu/loc of the normal continuous random variable
 LOC = 1.5
 
-# normal continuous random variable with loc=LOC and scale=1 (default)
-# https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.norm.html
-norm = norm_rv(LOC)
+# normalizing constant of the normal probability density function
+_INV_SQRT_2PI = 1 / math.sqrt(2 * math.pi)
+
+# resolution of the chart by default and on the client's request
+DPI = 200
+DPI_HIGH_RES = 600
+
+# Pillow's png encoder options: the fastest zlib level compresses the
+# flat-colored chart almost as well as the default level, at a fraction
+# of the encoding time
+PNG_OPTIONS = {"compress_level": 1, "optimize": False}
+
+# number of rendered charts kept by a worker and how long (in seconds)
+# clients and proxies may cache one: a chart never changes for given input
+CHART_CACHE_SIZE = 128
+CHART_MAX_AGE = 24 * 60 * 60
 
 runtime_config = {
     "axes.spines.right": False,
     "axes.spines.top": False,
     "axes.titlepad": 15,
-    "figure.dpi": 600,
+    "figure.dpi": DPI,
     "font.family": "Arial"
 }
+plt.switch_backend("agg")  # headless: no GUI backend resolution
 plt.rcParams.update(runtime_config)
 plt.style.use("cyberpunk")
 
 
+def _npdf(x: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Probability density function of N(LOC, 1).
+
+    Closed form of scipy.stats.norm(LOC).pdf without the overhead of
+    the frozen distribution machinery. If `out` is given, the density
+    is computed into it in place.
+    """
+
+    out = np.subtract(x, LOC, out=out)
+    np.square(out, out=out)
+    out *= -0.5
+    np.exp(out, out=out)
+    out *= _INV_SQRT_2PI
+    return out
+
+
+# static part of the sigma chart: the x-axis range, the grid the density
+# curve is drawn over and the curve itself never depend on the process,
+# so they are computed once at import time and shared by all requests
+XMIN, XMAX = -3, 6
+XTICKS = list(range(XMIN, XMAX + 1)) + [LOC]
+_X = np.linspace(XMIN, XMAX, 100*(XMAX - XMIN) + 1)
+_Y = _npdf(_X)
+_YLIM_TOP = _Y.max() + 0.03
+_X.flags.writeable = False
+_Y.flags.writeable = False
+_NORM_LABEL = f"$N(\\mu = {LOC}, \\sigma = 1)$"
+
+# buffers for the filled tail of the curve, the tail grid is the unit grid
+# scaled to [sigma, XMAX] in place (np.linspace can't write to a buffer)
+_T = np.linspace(0, 1, 50)
+_T.flags.writeable = False
+_XFILL = np.empty_like(_T)
+_YFILL = np.empty_like(_T)
+
+# Figure and Axes reused by every chart of the worker. The static part of
+# the chart is drawn once, each chart only adds its own artists and removes
+# them after rendering. Matplotlib is not thread-safe, so drawing (and
+# filling the buffers above) is serialized with the lock.
+# The figure bypasses pyplot's figure manager and keeps its own Agg canvas,
+# so savefig doesn't create a new canvas for every chart.
+_FIG = Figure(figsize=(8, 1.8))
+FigureCanvasAgg(_FIG)
+_AX = _FIG.subplots()
+_PLOT_LOCK = threading.Lock()
+
+_NORM_LINE, = _AX.plot(_X, _Y, lw=1.2, label=_NORM_LABEL)
+_AX.set_xlim(XMIN, XMAX)
+_AX.set_ylim(0, _YLIM_TOP)
+_AX.set_xticks(XTICKS)
+_AX.tick_params(axis="both", labelsize=8)
+_AX.xaxis.set_major_formatter(FormatStrFormatter("%.2g"))
+_AX.grid(lw=0.6)
+
+# glow effects of the density curve, hidden unless the client asks for them
+_static_artists = set(_AX.get_children())
+mplcyberpunk.make_lines_glow(_AX)
+mplcyberpunk.add_underglow(_AX)
+_GLOW_ARTISTS = [
+    artist for artist in _AX.get_children()
+    if artist not in _static_artists
+]
+del _static_artists
+
+
 class SigmaSupremum(Enum):
     """
     Unreachable upper bound of the sigma interval that corresponds
@@ -60,11 +147,24 @@ class SigmaSupremum(Enum):
     # GREEN = float("inf")
 
 
+# sorted suprema and the labels they bound, GREEN has no supremum
+_SUPREMA = tuple(supremum.value for supremum in SigmaSupremum)
+_LABELS = tuple(supremum.name for supremum in SigmaSupremum) + ("GREEN",)
+
+# style of the filled curve tail for each label
+_FILL_AES = {
+    label: {"color": label.lower(), "alpha": 0.44} for label in _LABELS
+}
+
+
 class SberProcess(BaseModel):
     """
     Process to evaluate with the SIX SIGMA approach.
     """
 
+    # the computed fields are cached, fields must not change after that
+    model_config = ConfigDict(frozen=True)
+
     tests: PositiveInt     # total number of tests
     fails: PositiveInt     # number of tests qualified as failed
 
@@ -91,65 +191,110 @@ class SberProcess(BaseModel):
         return self
 
     @computed_field
-    @property
+    @cached_property
     def defect_rate(self) -> float:
         return self.fails / self.tests
 
     @computed_field
-    @property
+    @cached_property
     def sigma(self) -> float:
-        # percent point function
-        return norm.ppf(1 - self.defect_rate).item()
+        # percent point function of N(LOC, 1): ndtri is the inverse of the
+        # standard normal CDF, calling it directly skips the overhead of
+        # the frozen distribution machinery
+        return float(ndtri(1 - self.defect_rate)) + LOC
 
     @computed_field
-    @property
+    @cached_property
     def label(self) -> str:
-        for supremum in SigmaSupremum:
-            if self.sigma < supremum.value:
-                return supremum.name
-        return "GREEN"
-
-    def plot_sigma_chart(self) -> BytesIO:
-        tests, fails, name, defect_rate, sigma, label = (
-            self.model_dump().values()
-        )
-        xmin, xmax = -3, 6
-        x = np.linspace(xmin, xmax, 100*(xmax - xmin) + 1)
-        y = norm.pdf(x)  # probability density function
-        xticks = list(range(xmin, xmax + 1)) + [LOC]
-        sigma_clamped = max(xmin, min(sigma, xmax))
-        xfill = np.linspace(sigma_clamped, xmax)
+        # number of suprema not greater than sigma is the index of the label
+        return _LABELS[bisect_right(_SUPREMA, self.sigma)]
+
+    def to_headers(self) -> dict[str, str]:
+        """
+        Process attributes as HTTP response headers, read directly
+        instead of serializing the model with model_dump().
+        """
+
+        return {
+            "process-" + attr_name: str(getattr(self, attr_name))
+            for attr_name in _HEADER_FIELDS
+        }
+
+    def plot_sigma_chart(self, dpi: int = DPI, glow: bool = False) -> BytesIO:
+        tests, fails, name = self.tests, self.fails, self.name
+        defect_rate, sigma, label = self.defect_rate, self.sigma, self.label
+        sigma_clamped = max(XMIN, min(sigma, XMAX))
 
         dr_label = f"Defect rate = {defect_rate * 100:.2f}%"
-        aes = {"label": dr_label, "color": label.lower(), "alpha": 0.44}
-        norm_label = f"$N(\\mu = {LOC}, \\sigma = 1)$"
         sigma_annotation = f"$\\sigma$ = {sigma:.3f}"
-        name = f", {name=}" if name else ""
-        title = f"{self.__class__.__name__}({tests=}, {fails=}{name})"
-
-        fig, ax = plt.subplots(figsize=(8, 1.8))
-        plt.plot(x, y, lw=1.2, label=norm_label)
-        plt.fill_between(xfill, norm.pdf(xfill), 0, **aes)
-        plt.annotate(sigma_annotation, size=15, xy=(0.84, 0.2))
-        plt.xlim(xmin, xmax)
-        plt.ylim(0, y.max() + 0.03)
-        plt.xticks(xticks)
-        plt.tick_params(axis="both", labelsize=8)
-        ax.xaxis.set_major_formatter(FormatStrFormatter("%.2g"))
-        plt.grid(lw=0.6)
-        plt.legend(frameon=True, framealpha=1, loc="upper left")
-        plt.title(title)
-
-        mplcyberpunk.make_lines_glow()
-        mplcyberpunk.add_underglow()
+        name = f", name={name!r}" if name else ""
+        title = f"{type(self).__name__}(tests={tests}, fails={fails}{name})"
 
         image_buffer = BytesIO()
-        plt.savefig(image_buffer, bbox_inches="tight", format="png")
-        plt.close(fig)
+
+        with _PLOT_LOCK:
+            ax = _AX
+            np.multiply(_T, XMAX - sigma_clamped, out=_XFILL)
+            np.add(_XFILL, sigma_clamped, out=_XFILL)
+            _npdf(_XFILL, out=_YFILL)
+
+            for artist in _GLOW_ARTISTS:
+                artist.set_visible(glow)
+
+            fill = ax.fill_between(
+                _XFILL, _YFILL, 0, label=dr_label, **_FILL_AES[label]
+            )
+            annotation = ax.annotate(sigma_annotation, size=15, xy=(0.84, 0.2))
+            ax.legend(
+                handles=[_NORM_LINE, fill],
+                frameon=True,
+                framealpha=1,
+                loc="upper left"
+            )
+            ax.set_title(title)
+
+            _FIG.savefig(
+                image_buffer,
+                bbox_inches="tight",
+                dpi=dpi,
+                format="png",
+                pil_kwargs=PNG_OPTIONS
+            )
+            fill.remove()
+            annotation.remove()
+
         return image_buffer
 
 
-app = FastAPI()
+# names of the process attributes returned in the response headers
+_HEADER_FIELDS = (
+    *SberProcess.model_fields,
+    *SberProcess.model_computed_fields
+)
+
+
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def render_sigma_chart(process: SberProcess, dpi: int, glow: bool) -> bytes:
+    """
+    PNG of the sigma chart of the process, served from the cache when the
+    same chart is requested again. The model is frozen, so it hashes and
+    compares by its fields only, whatever computed fields it has cached.
+    """
+
+    # the buffer is private to this chart, getvalue() hands over its bytes
+    # without a copy
+    return process.plot_sigma_chart(dpi, glow).getvalue()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # FastAPI memoizes the schema, building it on startup keeps the cost off
+    # the first /docs request
+    app.openapi()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.get("/")
@@ -157,20 +302,24 @@ async def redirect():
     return RedirectResponse(url="/docs")
 
 
+# plain def: rendering blocks, so FastAPI runs the endpoint in a threadpool
+# instead of stalling the event loop
 @app.get("/chart")
-async def sigma_chart_and_data_in_headers(
-    background_tasks: BackgroundTasks,
+def sigma_chart_and_data_in_headers(
     process: SberProcess = Depends(),
+    high_res: bool = False,
+    glow: bool = False,
 ):
-    image_buffer = process.plot_sigma_chart()
-    background_tasks.add_task(image_buffer.close)
-    headers = {"Content-Disposition": "inline; filename=chart.png"}
-
-    for attr_name, value in process.model_dump().items():
-        headers["process-" + attr_name] = str(value)
+    dpi = DPI_HIGH_RES if high_res else DPI
+    content = render_sigma_chart(process, dpi, glow)
+    headers = {
+        "Cache-Control": f"public, max-age={CHART_MAX_AGE}",
+        "Content-Disposition": "inline; filename=chart.png",
+        **process.to_headers()
+    }
 
     return Response(
-        content=image_buffer.getvalue(),
+        content=content,
         headers=headers,
         media_type="image/png"
     )